@@ -5,12 +5,20 @@
 
 ##################################################################
 #   The main routine solves the first oder differential equations using euler method
+#   (or the fourth order Runge-Kutta method, see rk4_step)
 #   To generate numerical solutions for the gas conversion rate into stars and versa-versa
 
 
+from dataclasses import dataclass, fields
+
+import numpy as np
+from numba import njit, prange
+
+
 # Assuming the instantaneous mixing approximation
 # (IMA), and that infall occurs after outflows in each timestep
 
+@njit(cache=True, fastmath=True)
 def enrich_gas(sfr, R, t):
     """This function executes star formation and gas return from supernovae.
     And calculates the gas mass remaining
@@ -35,6 +43,7 @@ def enrich_gas(sfr, R, t):
     return (-sfr + R*sfr)*t
 
 
+@njit(cache=True, fastmath=True)
 def remove_egas(sfr, alp, t):
     """This function calculates the outflow gas mass driven my supernovae
     and stellar winds
@@ -59,6 +68,7 @@ def remove_egas(sfr, alp, t):
     return (- alp*sfr)*t
 
 
+@njit(cache=True, fastmath=True)
 def gas_infall(bta, t):
     """This function calculates the total gas mass accreted 
     from outside the box.
@@ -84,6 +94,7 @@ def gas_infall(bta, t):
     return (bta)*t
 
 
+@njit(cache=True, fastmath=True)
 def total_stellar_mass(sfr, R, t):
     """This function calculates the mass of stars formed by exercuting
     star formation and gas return.
@@ -108,6 +119,7 @@ def total_stellar_mass(sfr, R, t):
     return (sfr - R*sfr)*t
 
 
+@njit(cache=True, fastmath=True)
 def enrich_metalgas(zg, sfr, yz, t):
     """This function calculates the new metal enrichment of gas by 
     supernovae.
@@ -134,6 +146,7 @@ def enrich_metalgas(zg, sfr, yz, t):
     return (-zg*sfr + yz*sfr)*t
 
 
+@njit(cache=True, fastmath=True)
 def remove_metalgas(zg, sfr, alp, t):
     """This function calculates fraction of the new metals removed from the 
     gas by supernovae.
@@ -160,6 +173,7 @@ def remove_metalgas(zg, sfr, alp, t):
     return (- alp*zg*sfr)*t
 
 
+@njit(cache=True, fastmath=True)
 def infall_metalgas(bta, znf, t):
     """This function calculates fraction of the new metals accreted
     into the gas from outside the box.
@@ -187,6 +201,7 @@ def infall_metalgas(bta, znf, t):
     return (bta*znf)*t
 
 
+@njit(cache=True, fastmath=True)
 def metal_mass_starphase(zg, sfr, R, t):
     """"This function calculates the metal mass content trapped in stars.
 
@@ -212,6 +227,7 @@ def metal_mass_starphase(zg, sfr, R, t):
     return (zg*sfr - zg*R*sfr)*t
 
 
+@njit(cache=True, fastmath=True)
 def total_mass_starpop(sfr, R, t):
     """This function calculates the total mass of stellar population 
     in each time step.
@@ -236,6 +252,7 @@ def total_mass_starpop(sfr, R, t):
     return (1 - R)*sfr*t
 
 
+@njit(cache=True, fastmath=True)
 def total_mass_metalpop(zg, sfr, R, t):
     """"This function calculates the total metal mass of stellar population 
     in each time step.
@@ -261,6 +278,7 @@ def total_mass_metalpop(zg, sfr, R, t):
     """
     return zg*(1 - R)*sfr*t
 
+@njit(cache=True, fastmath=True)
 def star_form_rate(alp_e, mg, mc, tdy):
     """"This function calculates the star fromation rate 
     in each time step.
@@ -286,6 +304,7 @@ def star_form_rate(alp_e, mg, mc, tdy):
     return ( alp_e*(mg - mc) ) / tdy
 
 
+@njit(cache=True, fastmath=True)
 def infall_rate(R, sfr):
     """This function calculates the gas infall rate in each
     in each time step.
@@ -305,6 +324,563 @@ def infall_rate(R, sfr):
     """
     return (1 - R)*sfr
 
+
+@njit(cache=True, fastmath=True)
+def gas_updates(sfr, R, alp, bta, zg, yz, znf, t):
+    """This function calculates all the gas-phase mass and metal mass
+    changes of one time step in a single call. It fuses enrich_gas,
+    remove_egas, gas_infall, enrich_metalgas, remove_metalgas and
+    infall_metalgas, sharing the common product sfr*t.
+
+    Parameters
+    ----------
+    sfr:float
+        star-formation rate.
+    R  :float
+        Super Novae returned fraction
+    alp:float
+        Outflow efficiency
+    bta:float
+        Infall rate
+    zg :float
+        Gas metallicity
+    yz :float
+        Metal yield
+    znf:float
+        infall gas metallicity
+    t  :float
+        Integration time step
+
+    Return
+    ---------
+    tuple of float:
+        (Mg_e, Mg_r, Mg_i, Mgz_e, Mgz_r, Mgz_i) the gas mass from
+        enrichment, outflow and infall, followed by the metal mass
+        in gas phase from enrichment, outflow and infall.
+
+    st    = sfr*t
+    Mg_e  = (R - 1)*st
+    Mg_r  = -alp*st
+    Mg_i  = bta*t
+    Mgz_e = (yz - zg)*st
+    Mgz_r = -alp*zg*st
+    Mgz_i = bta*znf*t
+    """
+    return gas_updates_precomputed(sfr, zg, bta*t, (R - 1.0)*t, -alp*t,
+                                   yz*t, znf, t)
+
+
+@njit(cache=True, fastmath=True)
+def gas_updates_precomputed(sfr, zg, bta_t, Rm1_t, neg_alp_t, yz_t, znf, t):
+    """Same as gas_updates, but taking the products of the run constants
+    with the time step, which the drivers evaluate once before the time
+    loop. Each term then costs a single multiply by sfr.
+
+    Parameters
+    ----------
+    sfr      :float
+        star-formation rate.
+    zg       :float
+        Gas metallicity
+    bta_t    :float
+        Infall rate times time step, bta*t
+    Rm1_t    :float
+        (R - 1)*t, with R the Super Novae returned fraction
+    neg_alp_t:float
+        -alp*t, with alp the Outflow efficiency
+    yz_t     :float
+        yz*t, with yz the Metal yield
+    znf      :float
+        infall gas metallicity
+    t        :float
+        Integration time step
+
+    Return
+    ---------
+    tuple of float:
+        (Mg_e, Mg_r, Mg_i, Mgz_e, Mgz_r, Mgz_i), see gas_updates
+    """
+    Mg_e  = Rm1_t*sfr
+    Mg_r  = neg_alp_t*sfr
+    Mg_i  = bta_t
+    Mgz_e = yz_t*sfr - zg*(sfr*t)
+    Mgz_r = zg*Mg_r
+    Mgz_i = znf*bta_t
+    return Mg_e, Mg_r, Mg_i, Mgz_e, Mgz_r, Mgz_i
+
+
+def _check_state(state, params, ndim):
+    """Raise ValueError unless state is a floating point array of shape
+    (4,) (ndim=1) or (Nreal, 4) (ndim=2) and params of the matching shape
+    (7,) or (Nreal, 7). The compiled kernels index both without bounds
+    checks and write their results in the dtype of state.
+    """
+    if not np.issubdtype(state.dtype, np.floating):
+        raise ValueError("state must be a floating point array, got %s"
+                         % state.dtype)
+    if (state.ndim != ndim or state.shape[-1] != 4
+            or params.shape != state.shape[:-1] + (7,)):
+        expected = "(4,) and (7,)" if ndim == 1 else "(Nreal, 4) and (Nreal, 7)"
+        raise ValueError("state and params must be of shape %s, got %s and %s"
+                         % (expected, state.shape, params.shape))
+
+
+@njit(cache=True, fastmath=True)
+def _derivs(state, params):
+    """Compiled kernel behind derivs, without input checks."""
+    Mgas, Mzgas = state[0], state[2]
+    R, alp, yz, znf = params[0], params[1], params[2], params[3]
+    alp_e, mc, tdy  = params[4], params[5], params[6]
+
+    zg  = Mzgas / Mgas
+    sfr = star_form_rate(alp_e, Mgas, mc, tdy)
+    bta = infall_rate(R, sfr)
+    Mg_e, Mg_r, Mg_i, Mgz_e, Mgz_r, Mgz_i = gas_updates(
+        sfr, R, alp, bta, zg, yz, znf, 1.0)
+
+    out    = np.empty_like(state)
+    out[0] = Mg_e + Mg_r + Mg_i
+    out[1] = total_stellar_mass(sfr, R, 1.0)
+    out[2] = Mgz_e + Mgz_r + Mgz_i
+    out[3] = metal_mass_starphase(zg, sfr, R, 1.0)
+    return out
+
+
+def derivs(state, params):
+    """This function calculates the time derivatives of the breathing
+    box state, built from the fused gas_updates kernel with a unit time
+    step.
+
+    Parameters
+    ----------
+    state: ndarray
+        (Mgas, Mstar, Mzgas, Mzstar) total gas mass, total stellar mass,
+        metal mass in gas phase and metal mass in stellar phase
+    params: ndarray
+        (R, alp, yz, znf, alp_e, mc, tdy) returned fraction, outflow
+        efficiency, metal yield, infall gas metallicity, star formation
+        effeciency, critical mass threshold and disc dynamical time
+
+    Return
+    ---------
+    ndarray:
+        (dMgas/dt, dMstar/dt, dMzgas/dt, dMzstar/dt)
+
+    Raises
+    ---------
+    ValueError
+        if state is not a floating point array of shape (4,) or params
+        not of shape (7,)
+    """
+    state, params = np.asarray(state), np.asarray(params)
+    _check_state(state, params, 1)
+    return _derivs(state, params)
+
+
+@njit(cache=True, fastmath=True)
+def _rk4_step(state, params, dt):
+    """Compiled kernel behind rk4_step, without input checks."""
+    k1 = _derivs(state, params)
+    k2 = _derivs(state + 0.5*dt*k1, params)
+    k3 = _derivs(state + 0.5*dt*k2, params)
+    k4 = _derivs(state + dt*k3, params)
+    out    = np.empty_like(state)
+    out[:] = state + (k1 + 2.0*k2 + 2.0*k3 + k4)*(dt/6.0)
+    return out
+
+
+def rk4_step(state, params, dt):
+    """This function advances the breathing box state by one time step
+    with the classical fourth order Runge-Kutta method. Its local error
+    is O(dt^5) against O(dt^2) for euler, so far larger steps can be
+    taken for the same accuracy.
+
+    Parameters
+    ----------
+    state: ndarray
+        (Mgas, Mstar, Mzgas, Mzstar), see derivs
+    params: ndarray
+        (R, alp, yz, znf, alp_e, mc, tdy), see derivs
+    dt: float
+        Integration time step
+
+    Return
+    ---------
+    ndarray:
+        the state at the end of the time step, of the same dtype as state
+
+    Raises
+    ---------
+    ValueError
+        if state is not a floating point array of shape (4,) or params
+        not of shape (7,)
+    """
+    state, params = np.asarray(state), np.asarray(params)
+    _check_state(state, params, 1)
+    return _rk4_step(state, params, dt)
+
+
+@njit(cache=True, fastmath=True)
+def _rk4_step_batch(state, params, dt):
+    """Compiled kernel behind rk4_step_batch, without input checks."""
+    k1 = _derivs_batch(state, params)
+    k2 = _derivs_batch(state + 0.5*dt*k1, params)
+    k3 = _derivs_batch(state + 0.5*dt*k2, params)
+    k4 = _derivs_batch(state + dt*k3, params)
+    out    = np.empty_like(state)
+    out[:] = state + (k1 + 2.0*k2 + 2.0*k3 + k4)*(dt/6.0)
+    return out
+
+
+
+
+def rk4_step_batch(state, params, dt):
+    """Batched version of rk4_step for an ensemble of realizations.
+
+    Parameters
+    ----------
+    state: ndarray
+        shape (Nreal, 4), see derivs
+    params: ndarray
+        shape (Nreal, 7), see derivs
+    dt: float
+        Integration time step
+
+    Return
+    ---------
+    ndarray:
+        shape (Nreal, 4) and dtype of state, the state at the end of the
+        time step
+
+    Raises
+    ---------
+    ValueError
+        if state is not a floating point array of shape (Nreal, 4) or
+        params not of shape (Nreal, 7)
+    """
+    state, params = np.asarray(state), np.asarray(params)
+    _check_state(state, params, 2)
+    return _rk4_step_batch(state, params, dt)
+
+
+@njit(cache=True, fastmath=True)
+def _derivs_batch(state, params):
+    """Compiled kernel behind derivs_batch, without input checks."""
+    Mgas, Mzgas     = state[:, 0], state[:, 2]
+    R, alp, yz, znf = params[:, 0], params[:, 1], params[:, 2], params[:, 3]
+    alp_e, mc, tdy  = params[:, 4], params[:, 5], params[:, 6]
+
+    zg  = Mzgas / Mgas
+    sfr = star_form_rate(alp_e, Mgas, mc, tdy)
+    bta = infall_rate(R, sfr)
+    Mg_e, Mg_r, Mg_i, Mgz_e, Mgz_r, Mgz_i = gas_updates(
+        sfr, R, alp, bta, zg, yz, znf, 1.0)
+
+    out       = np.empty_like(state)
+    out[:, 0] = Mg_e + Mg_r + Mg_i
+    out[:, 1] = -Mg_e
+    out[:, 2] = Mgz_e + Mgz_r + Mgz_i
+    out[:, 3] = -zg*Mg_e
+    return out
+
+
+def derivs_batch(state, params):
+    """Batched version of derivs for an ensemble of realizations. The
+    kernels are applied to whole columns of the (Nreal, 4) block, and
+    the result is written into a single output array.
+
+    Parameters
+    ----------
+    state: ndarray
+        shape (Nreal, 4), see derivs
+    params: ndarray
+        shape (Nreal, 7), see derivs
+
+    Return
+    ---------
+    ndarray:
+        shape (Nreal, 4) and dtype of state, the time derivatives of
+        every realization
+
+    Raises
+    ---------
+    ValueError
+        if state is not a floating point array of shape (Nreal, 4) or
+        params not of shape (Nreal, 7)
+    """
+    state, params = np.asarray(state), np.asarray(params)
+    _check_state(state, params, 2)
+    return _derivs_batch(state, params)
+
+
+def euler_step(state, params, dt):
+    """This function advances the breathing box state by one euler time
+    step in place, state += dt*derivs(state, params), as one multiply and
+    one add over the whole state block.
+
+    Parameters
+    ----------
+    state: ndarray
+        C-contiguous state of shape (4,) or (Nreal, 4), see derivs,
+        updated in place
+    params: ndarray
+        shape (7,) or (Nreal, 7), see derivs
+    dt: float
+        Integration time step
+
+    Return
+    ---------
+    ndarray:
+        state
+
+    Raises
+    ---------
+    ValueError
+        if state is not a C-contiguous floating point array or the shapes
+        do not match
+    """
+    params = np.asarray(params)
+    if not state.flags.c_contiguous:
+        raise ValueError("state must be a C-contiguous array")
+    if state.ndim == 1:
+        _check_state(state, params, 1)
+        deriv = _derivs(state, params)
+    else:
+        _check_state(state, params, 2)
+        deriv = _derivs_batch(state, params)
+    np.multiply(deriv, dt, out=deriv)
+    np.add(state, deriv, out=state)
+    return state
+
+
+def evolve_batch(Mgas0, Mzgas0, R, alp, yz, znf, alp_e, mc, tdy, t, Nsteps,
+                 Mstar0=0.0, Mzstar0=0.0, dtype=np.float32, method="euler"):
+    """Evolve an ensemble of breathing boxes with the euler method, or
+    the fourth order Runge-Kutta method which allows much larger t.
+    Every realization (e.g. a Monte-Carlo draw or a point in a parameter
+    sweep) is stepped together. The euler method runs as the compiled
+    run_simulation, the Runge-Kutta method makes one batched call per
+    time step.
+
+    Parameters
+    ----------
+    Mgas0, Mzgas0: float or array_like
+        initial gas mass and metal mass in gas phase
+    R, alp, yz, znf: float or array_like
+        returned fraction, outflow efficiency, metal yield and
+        infall gas metallicity
+    alp_e, mc, tdy: float or array_like
+        star formation effeciency, critical mass threshold and
+        disc dynamical time
+    t: float
+        Integration time step
+    Nsteps: int
+        number of time steps
+    Mstar0, Mzstar0: float or array_like
+        initial stellar mass and metal mass in stellar phase
+    dtype: data-type
+        floating point type of the history buffers, float32 halves
+        their memory traffic. The masses are always accumulated in
+        float64, float32 accumulation drifts by ~1e-4 over 1e4 steps
+    method: str
+        "euler" or "rk4"
+
+    Return
+    ---------
+    SimulationHistory:
+        buffers of shape (Nreal, Nsteps). Column i holds the state at
+        time i*t and the rates and stellar population formed during the
+        step that follows. With "rk4", MstarSP and MzstarSP are the
+        stellar mass and metal mass gained over the step and ZstarSP
+        their ratio.
+
+    Raises
+    ---------
+    ValueError
+        if method is not "euler" or "rk4"
+    """
+    if method not in ("euler", "rk4"):
+        raise ValueError("method must be 'euler' or 'rk4', got %r" % (method,))
+
+    (Mgas, Mzgas, Mstar, Mzstar,
+     R, alp, yz, znf, alp_e, mc, tdy) = [
+        np.array(a, dtype=np.float64) for a in np.broadcast_arrays(
+            Mgas0, Mzgas0, Mstar0, Mzstar0,
+            R, alp, yz, znf, alp_e, mc, tdy, np.zeros(1))[:-1]]
+
+    t      = float(t)
+    state0 = np.stack([Mgas, Mstar, Mzgas, Mzstar], axis=1)
+    params = np.stack([R, alp, yz, znf, alp_e, mc, tdy], axis=1)
+
+    if method == "rk4":
+        hist = SimulationHistory.empty((state0.shape[0], Nsteps), dtype=dtype)
+        _evolve_rk4(state0, params, t, hist)
+        return hist
+
+    return SimulationHistory.from_array(
+        run_simulation(state0, params, Nsteps, t, dtype=dtype))
+
+
+def _evolve_rk4(state, params, t, hist):
+    """Fourth order Runge-Kutta time loop behind evolve_batch, filling
+    hist of shape (Nreal, Nsteps) from the (Nreal, 4) float64 state.
+    """
+    Nreal = state.shape[0]
+    for i in range(hist.t.shape[1]):
+        Mgas, Mstar, Mzgas, Mzstar = state.T
+        Zgas  = Mzgas / Mgas
+        Zstar = np.divide(Mzstar, Mstar, out=np.zeros(Nreal), where=Mstar > 0)
+        sfr   = star_form_rate(params[:, 4], Mgas, params[:, 5], params[:, 6])
+        beta  = infall_rate(params[:, 0], sfr)
+
+        new      = _rk4_step_batch(state, params, t)
+        MstarSP  = new[:, 1] - Mstar
+        MzstarSP = new[:, 3] - Mzstar
+        ZstarSP  = np.divide(MzstarSP, MstarSP, out=Zgas.copy(),
+                             where=MstarSP != 0)
+
+        hist.t[:, i]        = i*t
+        hist.Mgas[:, i]     = Mgas
+        hist.Zgas[:, i]     = Zgas
+        hist.Mstar[:, i]    = Mstar
+        hist.Zstar[:, i]    = Zstar
+        hist.Mzgas[:, i]    = Mzgas
+        hist.Mzstar[:, i]   = Mzstar
+        hist.MstarSP[:, i]  = MstarSP
+        hist.ZstarSP[:, i]  = ZstarSP
+        hist.MzstarSP[:, i] = MzstarSP
+        hist.SFR[:, i]      = sfr
+        hist.beta[:, i]     = beta
+
+        state = new
+
+
+def evolve(init, R, alp, yz, znf, alp_e, mc, tdy, t, Nsteps,
+           dtype=np.float32, method="euler"):
+    """Evolve a single breathing box with the euler method, or with the
+    fourth order Runge-Kutta method. This is evolve_batch for a single
+    realization.
+
+    Parameters
+    ----------
+    init: simulation
+        initial conditions, only Mgas, Mstar, Mzgas and Mzstar are used
+    R, alp, yz, znf, alp_e, mc, tdy: float
+        model parameters, see evolve_batch
+    t: float
+        Integration time step
+    Nsteps: int
+        number of time steps
+    dtype: data-type
+        floating point type of the history buffers, see evolve_batch
+    method: str
+        "euler" or "rk4", see evolve_batch
+
+    Return
+    ---------
+    SimulationHistory:
+        buffers of shape (Nsteps,), see evolve_batch
+    """
+    hist = evolve_batch(init.Mgas, init.Mzgas, R, alp, yz, znf, alp_e, mc,
+                        tdy, t, Nsteps, Mstar0=init.Mstar, Mzstar0=init.Mzstar,
+                        dtype=dtype, method=method)
+    return SimulationHistory(*[a[0] for a in hist.to_dict().values()])
+
+
+@njit(parallel=True, cache=True, fastmath=True)
+def _march(state0, params, dt, out):
+    """Compiled euler time-march behind run_simulation. Realizations are
+    independent, so the outer loop is spread over threads with prange;
+    the inner loop only touches native floats and the preallocated out.
+    state0, params and dt must be float64, out may be of any float type.
+    """
+    Nreal, N_steps = out.shape[0], out.shape[1]
+    for r in prange(Nreal):
+        Mgas, Mstar, Mzgas, Mzstar = (state0[r, 0], state0[r, 1],
+                                      state0[r, 2], state0[r, 3])
+        R, alp, yz, znf = params[r, 0], params[r, 1], params[r, 2], params[r, 3]
+        alp_e, mc, tdy  = params[r, 4], params[r, 5], params[r, 6]
+
+        one_minus_R = 1.0 - R
+        Rm1_t       = -one_minus_R*dt
+        neg_alp_t   = -alp*dt
+        yz_t        = yz*dt
+
+        for i in range(N_steps):
+            Zgas  = Mzgas / Mgas
+            Zstar = Mzstar / Mstar if Mstar > 0 else 0.0
+            sfr   = star_form_rate(alp_e, Mgas, mc, tdy)
+            beta  = one_minus_R*sfr
+
+            Mg_e, Mg_r, Mg_i, Mgz_e, Mgz_r, Mgz_i = gas_updates_precomputed(
+                sfr, Zgas, beta*dt, Rm1_t, neg_alp_t, yz_t, znf, dt)
+            MstarSP = -Mg_e
+
+            out[r, i, 0]  = i*dt
+            out[r, i, 1]  = Mgas
+            out[r, i, 2]  = Zgas
+            out[r, i, 3]  = Mstar
+            out[r, i, 4]  = Zstar
+            out[r, i, 5]  = Mzgas
+            out[r, i, 6]  = Mzstar
+            out[r, i, 7]  = MstarSP
+            out[r, i, 8]  = Zgas
+            out[r, i, 9]  = Zgas*MstarSP
+            out[r, i, 10] = sfr
+            out[r, i, 11] = beta
+
+            Mgas   += Mg_e + Mg_r + Mg_i
+            Mzgas  += Mgz_e + Mgz_r + Mgz_i
+            Mstar  += MstarSP
+            Mzstar += Zgas*MstarSP
+
+
+def run_simulation(state0, params_array, N_steps, dt, dtype=np.float32):
+    """Evolve an ensemble of breathing boxes with the euler method as a
+    single compiled, multi-threaded call.
+
+    Parameters
+    ----------
+    state0: array_like
+        initial (Mgas, Mstar, Mzgas, Mzstar) of shape (Nreal, 4)
+    params_array: array_like
+        (R, alp, yz, znf, alp_e, mc, tdy) of shape (Nreal, 7), or (7,)
+        to use the same parameters for every realization, see derivs
+    N_steps: int
+        number of time steps
+    dt: float
+        Integration time step
+    dtype: data-type
+        floating point type of the output, the integration itself always
+        runs in float64, see evolve_batch
+
+    Return
+    ---------
+    ndarray:
+        shape (Nreal, N_steps, 12), the last axis ordered as the fields
+        of SimulationHistory (see SimulationHistory.from_array)
+
+    Raises
+    ---------
+    ValueError
+        if state0 is not of shape (Nreal, 4) or params_array can not be
+        broadcast to (Nreal, 7)
+    """
+    state0 = np.ascontiguousarray(np.atleast_2d(state0), dtype=np.float64)
+    params = np.atleast_2d(np.asarray(params_array, dtype=np.float64))
+    if state0.ndim != 2 or state0.shape[1] != 4:
+        raise ValueError("state0 must be of shape (Nreal, 4), got %s"
+                         % (state0.shape,))
+    Nreal = state0.shape[0]
+    if params.ndim != 2 or params.shape[1] != 7 or params.shape[0] not in (1, Nreal):
+        raise ValueError("params_array must be of shape (%d, 7) or (7,), got %s"
+                         % (Nreal, np.shape(params_array)))
+    params = np.ascontiguousarray(np.broadcast_to(params, (Nreal, 7)))
+    out    = np.empty((Nreal, N_steps, 12), dtype=dtype)
+    _march(state0, params, float(dt), out)
+    return out
+
+
 class simulation(object):
     """Initial conditions place holder class object to initialize and
     evolve with the simulation
@@ -341,6 +917,9 @@ class simulation(object):
     None
     """
 
+    __slots__ = ('t', 'Mgas', 'Zgas', 'Mstar', 'Zstar', 'Mzgas', 'Mzstar',
+                 'MstarSP', 'ZstarSP', 'MzstarSP', 'SFR', 'beta')
+
     def __init__(self, t, Mgas, 
                  Zgas, Mstar, 
                  Zstar, Mzgas, 
@@ -359,4 +938,55 @@ class simulation(object):
         self.ZstarSP  = ZstarSP
         self.MzstarSP = MzstarSP
         self.SFR      = SFR
-        self.beta     = beta
\ No newline at end of file
+        self.beta     = beta
+
+
+@dataclass(eq=False)
+class SimulationHistory(object):
+    """Struct-of-arrays record of a simulation run. Every quantity of the
+    simulation class is held in its own contiguous buffer indexed by time
+    step (and realization, for ensembles), so the drivers write
+    hist.Mgas[i] instead of creating one simulation object per step.
+
+    Parameters
+    ----------
+    t, Mgas, Zgas, Mstar, Zstar, Mzgas, Mzstar, MstarSP, ZstarSP,
+    MzstarSP, SFR, beta: ndarray
+        see simulation, all of the same shape
+    """
+    t:        np.ndarray
+    Mgas:     np.ndarray
+    Zgas:     np.ndarray
+    Mstar:    np.ndarray
+    Zstar:    np.ndarray
+    Mzgas:    np.ndarray
+    Mzstar:   np.ndarray
+    MstarSP:  np.ndarray
+    ZstarSP:  np.ndarray
+    MzstarSP: np.ndarray
+    SFR:      np.ndarray
+    beta:     np.ndarray
+
+    @classmethod
+    def empty(cls, shape, dtype=np.float32):
+        """Allocate uninitialised buffers of the given shape, e.g. Nsteps
+        or (Nreal, Nsteps). Single precision is the default for storage,
+        the drivers integrate in float64 and only round when recording."""
+        return cls(*[np.empty(shape, dtype=dtype) for _ in fields(cls)])
+
+    @classmethod
+    def from_array(cls, arr):
+        """Split an array whose last axis holds the twelve quantities in
+        field order, as returned by run_simulation, into contiguous
+        per-quantity buffers (copies, not strided views of arr)."""
+        return cls(*[np.ascontiguousarray(a) for a in np.moveaxis(arr, -1, 0)])
+
+    def to_dict(self):
+        """Return the buffers as a dict keyed by quantity name."""
+        return {f.name: getattr(self, f.name) for f in fields(self)}
+
+    def to_recarray(self):
+        """Return the buffers as a NumPy record array with one field per
+        quantity."""
+        return np.rec.fromarrays([getattr(self, f.name) for f in fields(self)],
+                                 names=[f.name for f in fields(self)])
@@ -0,0 +1,125 @@
+# cython: boundscheck=False, wraparound=False, cdivision=True
+##################################################################
+#
+#   Cython version of the breathing box time-march in galaxy_function.py
+#   (see run_simulation there). It only needs NumPy at run time, not numba.
+#
+#   Build in place with
+#       cythonize -3 --inplace galaxy_kernel.pyx
+
+##################################################################
+
+import numpy as np
+
+
+cdef void step(double* state, double* rec, double t_i, double one_minus_R,
+               double neg_alp_t, double yz_t, double znf, double alp_e,
+               double mc, double tdy, double dt) noexcept nogil:
+    """Record the current state in rec and advance state by one euler
+    time step.
+
+    Parameters
+    ----------
+    state: double*
+        (Mgas, Mstar, Mzgas, Mzstar), updated in place
+    rec: double*
+        12 slots, filled in the field order of SimulationHistory
+    t_i: double
+        time of the current step
+    one_minus_R, neg_alp_t, yz_t: double
+        per-run constants 1 - R, -alp*dt and yz*dt
+    znf, alp_e, mc, tdy: double
+        infall gas metallicity, star formation effeciency, critical
+        mass threshold and disc dynamical time
+    dt: double
+        Integration time step
+    """
+    cdef double Mgas   = state[0]
+    cdef double Mstar  = state[1]
+    cdef double Mzgas  = state[2]
+    cdef double Mzstar = state[3]
+
+    cdef double Zgas    = Mzgas / Mgas
+    cdef double Zstar   = Mzstar / Mstar if Mstar > 0 else 0.0
+    cdef double sfr     = ( alp_e*(Mgas - mc) ) / tdy
+    cdef double beta    = one_minus_R*sfr
+    cdef double bta_t   = beta*dt
+    cdef double MstarSP = one_minus_R*sfr*dt
+    cdef double Mg_r    = neg_alp_t*sfr
+
+    rec[0]  = t_i
+    rec[1]  = Mgas
+    rec[2]  = Zgas
+    rec[3]  = Mstar
+    rec[4]  = Zstar
+    rec[5]  = Mzgas
+    rec[6]  = Mzstar
+    rec[7]  = MstarSP
+    rec[8]  = Zgas
+    rec[9]  = Zgas*MstarSP
+    rec[10] = sfr
+    rec[11] = beta
+
+    state[0] = Mgas - MstarSP + Mg_r + bta_t
+    state[1] = Mstar + MstarSP
+    state[2] = Mzgas + (yz_t*sfr - Zgas*(sfr*dt)) + Zgas*Mg_r + znf*bta_t
+    state[3] = Mzstar + Zgas*MstarSP
+
+
+def run(double[:, ::1] state0, double[:, ::1] params, int N_steps, double dt):
+    """Evolve an ensemble of breathing boxes with the euler method, with
+    the whole time-march in C.
+
+    Parameters
+    ----------
+    state0: ndarray
+        initial (Mgas, Mstar, Mzgas, Mzstar) of shape (Nreal, 4), float64
+    params: ndarray
+        (R, alp, yz, znf, alp_e, mc, tdy) of shape (Nreal, 7), float64
+    N_steps: int
+        number of time steps
+    dt: float
+        Integration time step
+
+    Return
+    ---------
+    ndarray:
+        shape (Nreal, N_steps, 12), the last axis ordered as (t, Mgas,
+        Zgas, Mstar, Zstar, Mzgas, Mzstar, MstarSP, ZstarSP, MzstarSP,
+        SFR, beta), see galaxy_function.run_simulation
+
+    Raises
+    ---------
+    ValueError
+        if state0 is not of shape (Nreal, 4) or params of shape (Nreal, 7)
+    """
+    cdef Py_ssize_t Nreal = state0.shape[0]
+    if state0.shape[1] != 4:
+        raise ValueError("state0 must be of shape (Nreal, 4), got (%d, %d)"
+                         % (state0.shape[0], state0.shape[1]))
+    if params.shape[0] != Nreal or params.shape[1] != 7:
+        raise ValueError("params must be of shape (%d, 7), got (%d, %d)"
+                         % (Nreal, params.shape[0], params.shape[1]))
+    if N_steps < 0:
+        raise ValueError("N_steps must be non-negative")
+
+    out = np.empty((Nreal, N_steps, 12))
+    cdef double[:, :, ::1] rec = out
+    cdef double state[4]
+    cdef Py_ssize_t r, i, k
+    cdef double one_minus_R, neg_alp_t, yz_t
+
+    with nogil:
+        for r in range(Nreal):
+            for k in range(4):
+                state[k] = state0[r, k]
+            one_minus_R = 1.0 - params[r, 0]
+            neg_alp_t   = -params[r, 1]*dt
+            yz_t        = params[r, 2]*dt
+
+            for i in range(N_steps):
+                step(state, &rec[r, i, 0], i*dt, one_minus_R, neg_alp_t,
+                     yz_t, params[r, 3], params[r, 4], params[r, 5],
+                     params[r, 6], dt)
+
+    return out
@@ -0,0 +1,263 @@
+import numpy as np
+import pytest
+
+import galaxy_function as gf
+
+
+# Milky-Way-like box used for the long runs
+LONG_RUN = dict(Mgas0=1e10, Mzgas0=1e7, R=0.3, alp=1.0, yz=0.02, znf=0.001,
+                alp_e=0.1, mc=1e8, tdy=0.05)
+MASSES   = ('Mgas', 'Mstar', 'Mzgas', 'Mzstar')
+
+
+def _long_run_arrays():
+    p = LONG_RUN
+    state0 = np.array([[p['Mgas0'], 0.0, p['Mzgas0'], 0.0]])
+    params = np.array([[p['R'], p['alp'], p['yz'], p['znf'],
+                        p['alp_e'], p['mc'], p['tdy']]])
+    return state0, params
+
+
+@pytest.mark.parametrize('dt', [1e-6, 1e-7])
+def test_float32_history_tracks_float64_on_long_runs(dt):
+    p    = LONG_RUN
+    args = (p['Mgas0'], p['Mzgas0'], p['R'], p['alp'], p['yz'], p['znf'],
+            p['alp_e'], p['mc'], p['tdy'], dt, 20000)
+    h32 = gf.evolve_batch(*args)
+    h64 = gf.evolve_batch(*args, dtype=np.float64)
+    assert h32.Mgas.dtype == np.float32
+    for key in MASSES:
+        np.testing.assert_allclose(getattr(h32, key), getattr(h64, key),
+                                   rtol=1e-6, atol=0)
+
+    state0, params = _long_run_arrays()
+    o32 = gf.run_simulation(state0, params, 20000, dt)
+    o64 = gf.run_simulation(state0, params, 20000, dt, dtype=np.float64)
+    assert o32.dtype == np.float32
+    np.testing.assert_allclose(o32[..., [1, 3, 5, 6]], o64[..., [1, 3, 5, 6]],
+                               rtol=1e-6, atol=0)
+
+
+def test_baryon_budget_is_conserved_on_long_runs():
+    # Mgas + Mstar only changes through outflow and infall
+    state0, params = _long_run_arrays()
+    dt   = 1e-6
+    hist = gf.SimulationHistory.from_array(
+        gf.run_simulation(state0, params, 20000, dt))
+    outflow = np.cumsum(LONG_RUN['alp']*hist.SFR.astype(np.float64)*dt)
+    infall  = np.cumsum(hist.beta.astype(np.float64)*dt)
+    budget  = (hist.Mgas[0, 1:].astype(np.float64) + hist.Mstar[0, 1:]
+               + outflow[:-1] - infall[:-1])
+    np.testing.assert_allclose(budget, budget[0], rtol=1e-6)
+
+
+def test_run_simulation_broadcasts_shared_params():
+    state0 = np.array([[10.0, 0.0, 0.1, 0.0], [20.0, 0.0, 0.2, 0.0]])
+    params = np.array([0.3, 0.5, 0.02, 0.001, 0.1, 1.0, 1.0])
+    out = gf.run_simulation(state0, params, 10, 0.01, dtype=np.float64)
+    ref = gf.run_simulation(state0, np.tile(params, (2, 1)), 10, 0.01,
+                            dtype=np.float64)
+    assert np.isfinite(out).all()
+    np.testing.assert_array_equal(out, ref)
+
+
+@pytest.mark.parametrize('state0, params', [
+    (np.ones((2, 4)), np.ones((3, 7))),
+    (np.ones((3, 4)), np.ones((2, 7))),
+    (np.ones((2, 4)), np.ones((2, 5))),
+    (np.ones((2, 2)), np.ones((2, 7))),
+])
+def test_run_simulation_rejects_mismatched_shapes(state0, params):
+    with pytest.raises(ValueError):
+        gf.run_simulation(state0, params, 3, 0.1)
+
+
+def test_cython_kernel_matches_run_simulation():
+    gk = pytest.importorskip('galaxy_kernel')
+    state0 = np.array([[10.0, 0.0, 0.1, 0.0], [20.0, 0.0, 0.2, 0.0]])
+    params = np.array([[0.3, 0.5, 0.02, 0.001, 0.1, 1.0, 1.0],
+                       [0.3, 1.0, 0.02, 0.001, 0.1, 1.0, 1.0]])
+    out = gk.run(state0, params, 200, 0.01)
+    ref = gf.run_simulation(state0, params, 200, 0.01, dtype=np.float64)
+    np.testing.assert_allclose(out, ref, rtol=1e-13, atol=1e-15)
+
+
+@pytest.mark.parametrize('state0, params', [
+    (np.zeros((2, 2)), np.ones((2, 7))),
+    (np.ones((2, 4)), np.ones((1, 7))),
+    (np.ones((2, 4)), np.ones((2, 5))),
+])
+def test_cython_kernel_rejects_mismatched_shapes(state0, params):
+    gk = pytest.importorskip('galaxy_kernel')
+    with pytest.raises(ValueError):
+        gk.run(state0, params, 3, 0.1)
+
+
+STATE0 = np.array([[10.0, 0.0, 0.1, 0.0], [20.0, 0.0, 0.2, 0.0]])
+PARAMS = np.array([[0.3, 0.5, 0.02, 0.001, 0.1, 1.0, 1.0],
+                   [0.3, 1.0, 0.02, 0.001, 0.1, 1.0, 1.0]])
+
+
+def test_derivs_batch_matches_derivs_per_row():
+    d = gf.derivs_batch(STATE0, PARAMS)
+    for r in range(len(STATE0)):
+        np.testing.assert_allclose(d[r], gf.derivs(STATE0[r], PARAMS[r]),
+                                   rtol=1e-14)
+
+
+def test_derivative_steps_keep_state_dtype():
+    s32 = STATE0.astype(np.float32)
+    assert gf.derivs(s32[0], PARAMS[0]).dtype == np.float32
+    assert gf.rk4_step(s32[0], PARAMS[0], 0.1).dtype == np.float32
+    assert gf.derivs_batch(s32, PARAMS).dtype == np.float32
+    assert gf.euler_step(s32, PARAMS, 0.1).dtype == np.float32
+
+
+@pytest.mark.parametrize('params', [PARAMS[:1], PARAMS[:, :5], PARAMS[0]])
+def test_derivs_batch_rejects_mismatched_params(params):
+    with pytest.raises(ValueError):
+        gf.derivs_batch(STATE0, params)
+    with pytest.raises(ValueError):
+        gf.rk4_step_batch(STATE0, params, 0.1)
+    with pytest.raises(ValueError):
+        gf.euler_step(STATE0.copy(), params, 0.1)
+
+
+def test_derivative_steps_reject_integer_states():
+    state = np.array([10, 0, 1, 0])
+    with pytest.raises(ValueError):
+        gf.derivs(state, PARAMS[0])
+    with pytest.raises(ValueError):
+        gf.rk4_step(state, PARAMS[0], 0.1)
+    with pytest.raises(ValueError):
+        gf.euler_step(state, PARAMS[0], 0.1)
+    with pytest.raises(ValueError):
+        gf.derivs_batch(state[None], PARAMS[:1])
+    np.testing.assert_allclose(gf.derivs(state.astype(float), PARAMS[0]),
+                               [-0.45, 0.63, -0.11637, 0.063], rtol=1e-12)
+
+
+@pytest.mark.parametrize('state, params', [
+    (STATE0[0], PARAMS[0, :5]),
+    (STATE0[0, :3], PARAMS[0]),
+    (STATE0, PARAMS),
+])
+def test_derivs_reject_mismatched_shapes(state, params):
+    with pytest.raises(ValueError):
+        gf.derivs(state, params)
+    with pytest.raises(ValueError):
+        gf.rk4_step(state, params, 0.1)
+
+
+def test_rk4_driver_beats_euler_at_large_steps():
+    args = (10.0, 0.1, 0.3, 0.5, 0.02, 0.001, 0.1, 1.0, 1.0)
+    ref  = gf.evolve_batch(*args, 0.01, 1001, dtype=np.float64, method="rk4")
+    rk4  = gf.evolve_batch(*args, 1.0, 11, dtype=np.float64, method="rk4")
+    eul  = gf.evolve_batch(*args, 1.0, 11, dtype=np.float64)
+    for key in MASSES:
+        exact   = getattr(ref, key)[0, ::100]
+        err_rk4 = np.abs(getattr(rk4, key)[0] - exact).max()
+        err_eul = np.abs(getattr(eul, key)[0] - exact).max()
+        assert err_rk4 < 1e-3*err_eul
+
+    ic  = gf.simulation(0.0, 10.0, 0.01, 0.0, 0.0, 0.1, 0.0, 0, 0, 0, 0, 0)
+    one = gf.evolve(ic, *args[2:], 1.0, 11, dtype=np.float64, method="rk4")
+    for key, value in one.to_dict().items():
+        np.testing.assert_array_equal(value, getattr(rk4, key)[0])
+
+
+def test_evolve_batch_rejects_unknown_method():
+    with pytest.raises(ValueError):
+        gf.evolve_batch(10.0, 0.1, 0.3, 0.5, 0.02, 0.001, 0.1, 1.0, 1.0,
+                        0.1, 5, method="midpoint")
+
+
+# sfr, R, alp, bta, zg, yz, znf, t
+SFR, R, ALP, BTA, ZG, YZ, ZNF, T = 2.0, 0.3, 0.5, 1.2, 0.01, 0.02, 0.001, 0.1
+
+
+@pytest.mark.parametrize('func, args, expected', [
+    (gf.enrich_gas,           (SFR, R, T),         -0.14),
+    (gf.remove_egas,          (SFR, ALP, T),       -0.1),
+    (gf.gas_infall,           (BTA, T),             0.12),
+    (gf.total_stellar_mass,   (SFR, R, T),          0.14),
+    (gf.enrich_metalgas,      (ZG, SFR, YZ, T),     0.002),
+    (gf.remove_metalgas,      (ZG, SFR, ALP, T),   -0.001),
+    (gf.infall_metalgas,      (BTA, ZNF, T),        0.00012),
+    (gf.metal_mass_starphase, (ZG, SFR, R, T),      0.0014),
+    (gf.total_mass_starpop,   (SFR, R, T),          0.14),
+    (gf.total_mass_metalpop,  (ZG, SFR, R, T),      0.0014),
+    (gf.star_form_rate,       (0.1, 10.0, 1.0, 2.0), 0.45),
+    (gf.infall_rate,          (R, SFR),             1.4),
+])
+def test_helpers_are_pinned(func, args, expected):
+    assert func(*args) == pytest.approx(expected, rel=1e-12)
+
+
+def test_fused_gas_kernels_are_pinned():
+    expected = (-0.14, -0.1, 0.12, 0.002, -0.001, 0.00012)
+    assert gf.gas_updates(SFR, R, ALP, BTA, ZG, YZ, ZNF, T) == \
+        pytest.approx(expected, rel=1e-12)
+    assert gf.gas_updates_precomputed(SFR, ZG, BTA*T, (R - 1)*T, -ALP*T,
+                                      YZ*T, ZNF, T) == \
+        pytest.approx(expected, rel=1e-12)
+
+
+def test_derivs_are_pinned():
+    np.testing.assert_allclose(gf.derivs(STATE0[0], PARAMS[0]),
+                               [-0.45, 0.63, 0.00513, 0.0063], rtol=1e-12)
+
+
+def test_euler_drivers_agree():
+    dt, n = 0.1, 5
+    batch = gf.evolve_batch(STATE0[:, 0], STATE0[:, 2], *PARAMS.T, dt, n,
+                            dtype=np.float64)
+    # Mgas - mc decays by (1 - alp*alp_e*dt/tdy) per step
+    assert batch.Mgas[0, -1] == pytest.approx(1.0 + 9.0*0.995**4, rel=1e-12)
+
+    march = gf.SimulationHistory.from_array(
+        gf.run_simulation(STATE0, PARAMS, n, dt, dtype=np.float64))
+    for r in range(len(STATE0)):
+        ic  = gf.simulation(0.0, STATE0[r, 0], 0.0, STATE0[r, 1], 0.0,
+                            STATE0[r, 2], STATE0[r, 3], 0, 0, 0, 0, 0)
+        one = gf.evolve(ic, *PARAMS[r], dt, n, dtype=np.float64)
+        for key, value in one.to_dict().items():
+            np.testing.assert_allclose(getattr(batch, key)[r], value,
+                                       rtol=1e-13, atol=1e-15)
+            np.testing.assert_allclose(getattr(march, key)[r], value,
+                                       rtol=1e-13, atol=1e-15)
+
+    state = STATE0.copy()
+    for _ in range(n - 1):
+        gf.euler_step(state, PARAMS, dt)
+    for k, key in enumerate(MASSES):
+        np.testing.assert_allclose(state[:, k], getattr(batch, key)[:, -1],
+                                   rtol=1e-13, atol=1e-15)
+
+
+def test_rk4_step_is_fourth_order():
+    def integrate(dt, T=4.0):
+        state = STATE0[0].copy()
+        for _ in range(int(round(T/dt))):
+            state = gf.rk4_step(state, PARAMS[0], dt)
+        return state
+
+    ref    = integrate(1.0/256)
+    errors = [np.abs(integrate(dt) - ref).max() for dt in (1.0, 0.5, 0.25)]
+    for coarse, fine in zip(errors, errors[1:]):
+        assert 12.0 < coarse/fine < 20.0
+
+
+def test_simulation_history_compares_by_identity():
+    a = gf.SimulationHistory.empty(3)
+    b = gf.SimulationHistory.empty(3)
+    assert a == a
+    assert a != b
+
+
+def test_from_array_gives_contiguous_buffers():
+    hist = gf.SimulationHistory.from_array(
+        gf.run_simulation(STATE0, PARAMS, 5, 0.1))
+    for value in hist.to_dict().values():
+        assert value.shape == (2, 5)
+        assert value.flags.c_contiguous